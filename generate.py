@@ -1,8 +1,14 @@
 import sys
-import copy
-from collections import deque
+import heapq
+import multiprocessing
+from collections import Counter
 from crossword import *
 
+# Gerador e variável da raiz usados pelos processos de `backtrack_parallel`;
+# enviados uma única vez a cada processo pelo inicializador do pool
+_branch_creator = None
+_branch_var = None
+
 
 class CrosswordCreator():
 
@@ -11,10 +17,79 @@ class CrosswordCreator():
         Cria um novo gerador de CSP para crosswords.
         """
         self.crossword = crossword
+        # Tabela global de palavras: os domínios são bitsets (int) em que o
+        # bit i indica a presença da palavra `self._words[i]`
+        self._words = sorted(self.crossword.words)
+        self._word_id = {word: i for i, word in enumerate(self._words)}
+        # Letras de cada palavra como códigos inteiros: indexá-los não cria
+        # strings de um caractere no caminho crítico
+        self._codes = [tuple(map(ord, word)) for word in self._words]
+        # Bitset das palavras de cada comprimento, `self._by_length[length]`, e
+        # bitset das palavras com cada letra (código) em cada posição,
+        # `self._support[pos][letter]`
+        self._by_length = dict()
+        self._support = []
+        for i, word in enumerate(self._codes):
+            self._by_length[len(word)] = (
+                self._by_length.get(len(word), 0) | (1 << i)
+            )
+            for pos, letter in enumerate(word):
+                if pos == len(self._support):
+                    self._support.append(dict())
+                support = self._support[pos]
+                support[letter] = support.get(letter, 0) | (1 << i)
+        # Variáveis mais longas que todas as palavras ficam sem suporte algum
+        for var in self.crossword.variables:
+            while len(self._support) < var.length:
+                self._support.append(dict())
+        # Cada domínio já começa apenas com as palavras do comprimento certo
         self.domains = {
-            var: self.crossword.words.copy()
+            var: self._by_length.get(var.length, 0)
+            for var in self.crossword.variables
+        }
+        # O grafo de restrições é estático: calcula os vizinhos uma única vez
+        self._neighbors = {
+            var: tuple(self.crossword.neighbors(var))
             for var in self.crossword.variables
         }
+        # Identificadores inteiros das variáveis, calculados uma única vez:
+        # arcos, fila do AC-3 e tamanhos dos domínios são indexados por eles,
+        # evitando chamar Variable.__hash__ (em Python) no laço do AC-3
+        self._variables = list(self.crossword.variables)
+        self._vid = {var: i for i, var in enumerate(self._variables)}
+        self._neighbor_ids = [
+            tuple(self._vid[neighbor] for neighbor in self._neighbors[var])
+            for var in self._variables
+        ]
+        # Lista de adjacência com as sobreposições já resolvidas:
+        # `self._adjacency[var]` contém triplas (vizinho, i, j), em que o
+        # i-ésimo caractere de var sobrepõe o j-ésimo caractere do vizinho
+        self._adjacency = {
+            var: tuple(
+                (neighbor, *self.crossword.overlaps[var, neighbor])
+                for neighbor in self._neighbors[var]
+            )
+            for var in self.crossword.variables
+        }
+        # Constantes de cada arco (id de x, id de y) usadas por `revise_arc`,
+        # resolvidas uma única vez: posições da sobreposição e bitsets de
+        # letras de x em xi
+        self._arcs = dict()
+        for (x, y), overlap in self.crossword.overlaps.items():
+            if overlap is not None:
+                xi, yi = overlap
+                self._arcs[self._vid[x], self._vid[y]] = (
+                    xi, yi, self._support[xi]
+                )
+        # Cache das letras presentes em cada posição do domínio de uma variável
+        self._letter_index = dict()
+        # Tamanhos dos domínios, indexados pelo id da variável, e fila de
+        # prioridade para a heurística MRV
+        self._domain_sizes = [
+            self.domains[var].bit_count() for var in self._variables
+        ]
+        self._mrv_heap = []
+        self.rebuild_mrv_heap()
 
     def letter_grid(self, assignment):
         """
@@ -92,12 +167,17 @@ class CrosswordCreator():
 
         img.save(filename)
 
-    def solve(self):
+    def solve(self, workers=None):
         """
         Aplica consistência de nó e arco, e então resolve o CSP.
+        Se `workers` for maior que 1, os valores da primeira variável são
+        explorados em paralelo por esse número de processos; nesse caso a
+        solução retornada pode diferir da busca sequencial.
         """
         self.enforce_node_consistency()
         self.ac3()
+        if workers is not None and workers > 1:
+            return self.backtrack_parallel(workers)
         return self.backtrack(dict())
 
     def enforce_node_consistency(self):
@@ -106,67 +186,157 @@ class CrosswordCreator():
         Remove quaisquer palavras que não correspondam ao comprimento da variável.
         """
         for var in self.crossword.variables:
-            words_to_remove = set()
-            for word in self.domains[var]:
-                if len(word) != var.length:
-                    words_to_remove.add(word)
-            if words_to_remove:
-                self.domains[var] -= words_to_remove
+            words_to_keep = self.domains[var] & self._by_length.get(var.length, 0)
+            if words_to_keep != self.domains[var]:
+                self.update_domain(var, words_to_keep)
 
-    def revise(self, x, y):
+    def revise(self, x, y, trail=None):
         """
         Torna a variável x consistente com a variável y.
+        Se `trail` for fornecido, registra nele o par (x, domínio anterior de x).
         Retorna True se alguma revisão foi feita na domínio de x; False caso contrário.
         """
+        return self.revise_arc(self._vid[x], self._vid[y], trail)
+
+    def revise_arc(self, x_id, y_id, trail=None):
+        """
+        Como `revise`, mas recebe os identificadores inteiros de x e y.
+        """
         revised = False
-        overlap = self.crossword.overlaps.get((x, y))
+        arc = self._arcs.get((x_id, y_id))
 
-        if overlap is None:
+        if arc is None:
             return False  # Nenhuma sobreposição, nenhuma revisão necessária
 
-        xi, yi = overlap
-        words_to_remove = set()
+        xi, yi, support = arc
+        x = self._variables[x_id]
+        y = self._variables[y_id]
+        domain_x = self.domains[x]
+        domain_y = self.domains[y]
+
+        if domain_y and not domain_y & (domain_y - 1):
+            # Domínio unitário (caso comum após uma atribuição): basta manter
+            # em x as palavras com a mesma letra da única palavra de y
+            letter = self._codes[domain_y.bit_length() - 1][yi]
+            words_to_keep = support.get(letter, 0) & domain_x
+        else:
+            # Letras que possuem suporte em y na posição de sobreposição
+            allowed = self.allowed_letters(y, yi)
+            # Se todas as letras de x na sobreposição têm suporte, nada a remover;
+            # a comparação entre conjuntos evita percorrer o domínio palavra a palavra
+            if self.allowed_letters(x, xi) <= allowed:
+                return False
+            # Mantém em x apenas as palavras cuja letra em xi tem suporte em y
+            words_to_keep = 0
+            for letter in allowed:
+                words_to_keep |= support.get(letter, 0)
+            words_to_keep &= domain_x
+
+        if words_to_keep != domain_x:
+            if trail is not None:
+                trail.append((x, domain_x))
+            self.update_domain(x, words_to_keep)
+            revised = True
 
-        for word_x in self.domains[x]:
-            # Verifica se existe pelo menos uma palavra em y que seja compatível
-            match_found = False
-            for word_y in self.domains[y]:
-                if word_x[xi] == word_y[yi]:
-                    match_found = True
-                    break
-            if not match_found:
-                words_to_remove.add(word_x)
-                revised = True
+        return revised
 
-        if revised:
-            self.domains[x] -= words_to_remove
+    def allowed_letters(self, var, pos):
+        """
+        Retorna o conjunto dos códigos das letras que aparecem na posição `pos`
+        das palavras no domínio de var.
+        """
+        return self.letter_counts(var, pos).keys()
 
-        return revised
+    def letter_counts(self, var, pos):
+        """
+        Retorna um Counter com o número de palavras no domínio de var
+        que possuem cada letra (código) na posição `pos`.
+        """
+        index = self._letter_index.setdefault(var, dict())
+        if pos not in index:
+            domain = self.domains[var]
+            counts = Counter()
+            for letter, words in self._support[pos].items():
+                count = (domain & words).bit_count()
+                if count:
+                    counts[letter] = count
+            index[pos] = counts
+        return index[pos]
+
+    def domain_values(self, var):
+        """
+        Gera os identificadores das palavras no domínio de var, em ordem crescente.
+        """
+        bits = bin(self.domains[var])[:1:-1]
+        i = bits.find("1")
+        while i != -1:
+            yield i
+            i = bits.find("1", i + 1)
 
-    def ac3(self, arcs=None):
+    def update_domain(self, var, domain):
+        """
+        Substitui o domínio de var, mantendo atualizados o tamanho em cache,
+        a fila de prioridade da heurística MRV e o cache de letras.
+        """
+        self.domains[var] = domain
+        size = domain.bit_count()
+        var_id = self._vid[var]
+        self._domain_sizes[var_id] = size
+        heapq.heappush(
+            self._mrv_heap,
+            (size, -len(self._neighbors[var]), var_id, var)
+        )
+        self.invalidate_letters(var)
+
+    def invalidate_letters(self, var):
+        """
+        Descarta o cache de letras de var após uma alteração no seu domínio.
+        """
+        self._letter_index.pop(var, None)
+
+    def ac3(self, arcs=None, trail=None):
         """
         Aplica o algoritmo AC3 para impor consistência de arco.
+        As remoções são registradas em `trail`, se fornecido.
         Retorna True se a consistência for alcançada sem domínios vazios; False caso contrário.
         """
-        queue = deque()
-
         if arcs is None:
             # Inicializa a fila com todos os arcos
-            for var in self.crossword.variables:
-                for neighbor in self.crossword.neighbors(var):
-                    queue.append((var, neighbor))
+            arcs = list(self._arcs)
         else:
-            for arc in arcs:
-                queue.append(arc)
+            vid = self._vid
+            arcs = [(vid[x], vid[y]) for x, y in arcs]
+
+        # Referências locais evitam buscas de atributos a cada iteração;
+        # arcos, fila e tamanhos usam os identificadores inteiros das variáveis
+        revise_arc = self.revise_arc
+        sizes = self._domain_sizes
+        neighbor_ids = self._neighbor_ids
+
+        def push(x_id, y_id):
+            # Prioriza arcos cujo y tem o menor domínio: podam mais e mais cedo
+            heapq.heappush(queue, (sizes[y_id], sizes[x_id], x_id, y_id))
+
+        queue = []
+        # Arcos atualmente na fila, para não enfileirar o mesmo arco duas vezes
+        in_queue = set()
+        for arc in arcs:
+            if arc not in in_queue:
+                in_queue.add(arc)
+                push(*arc)
 
         while queue:
-            (x, y) = queue.popleft()
-            if self.revise(x, y):
-                if not self.domains[x]:
+            x_id, y_id = heapq.heappop(queue)[2:]
+            in_queue.discard((x_id, y_id))
+            if revise_arc(x_id, y_id, trail):
+                if not sizes[x_id]:
                     return False  # Domínio eliminado
-                for neighbor in self.crossword.neighbors(x):
-                    if neighbor != y:
-                        queue.append((neighbor, x))
+                for neighbor_id in neighbor_ids[x_id]:
+                    if neighbor_id != y_id:
+                        arc = (neighbor_id, x_id)
+                        if arc not in in_queue:
+                            in_queue.add(arc)
+                            push(neighbor_id, x_id)
         return True
 
     def assignment_complete(self, assignment):
@@ -189,80 +359,234 @@ class CrosswordCreator():
             if len(word) != var.length:
                 return False
             # Verifica sobreposições com vizinhos
-            for neighbor in self.crossword.neighbors(var):
+            for neighbor, xi, yi in self._adjacency[var]:
                 if neighbor in assignment:
-                    overlap = self.crossword.overlaps.get((var, neighbor))
-                    if overlap:
-                        xi, yi = overlap
-                        if word[xi] != assignment[neighbor][yi]:
-                            return False
+                    if word[xi] != assignment[neighbor][yi]:
+                        return False
+        return True
+
+    def consistent_value(self, var, value, assigned_ids):
+        """
+        Verifica se atribuir value (identificador de palavra) a var mantém
+        consistente uma atribuição que já é consistente, checando apenas as
+        restrições de comprimento e de sobreposição envolvendo var.
+        `assigned_ids` mapeia cada variável atribuída ao identificador da sua
+        palavra. A unicidade é verificada em `backtrack`.
+        """
+        codes = self._codes[value]
+        if len(codes) != var.length:
+            return False
+        for neighbor, xi, yi in self._adjacency[var]:
+            if neighbor in assigned_ids:
+                if codes[xi] != self._codes[assigned_ids[neighbor]][yi]:
+                    return False
         return True
 
     def order_domain_values(self, var, assignment):
         """
-        Retorna uma lista de valores no domínio de var, ordenados pela heurística do menor conflito.
+        Gera os valores no domínio de var, ordenados pela heurística do menor conflito.
+        Os valores são identificadores de palavras.
         """
-        def count_conflicts(value):
-            count = 0
-            for neighbor in self.crossword.neighbors(var):
-                if neighbor in assignment:
-                    continue
-                overlap = self.crossword.overlaps.get((var, neighbor))
-                if overlap:
-                    xi, yi = overlap
-                    for neighbor_word in self.domains[neighbor]:
-                        if value[xi] != neighbor_word[yi]:
-                            count += 1
-            return count
+        if self._domain_sizes[self._vid[var]] == 1:
+            # Um único valor: não há o que ordenar
+            yield self.domains[var].bit_length() - 1
+            return
+
+        # Para cada vizinho não atribuído, o número de palavras eliminadas por
+        # um valor é o tamanho do domínio menos as palavras com a mesma letra
+        histograms = []
+        for neighbor, xi, yi in self._adjacency[var]:
+            if neighbor in assignment:
+                continue
+            histograms.append((
+                xi,
+                self._domain_sizes[self._vid[neighbor]],
+                self.letter_counts(neighbor, yi)
+            ))
 
-        # Ordena os valores pelo número de conflitos (ascendente)
-        return sorted(self.domains[var], key=count_conflicts)
+        def count_conflicts(value):
+            word = self._codes[value]
+            return sum(
+                size - counts[word[xi]]
+                for xi, size, counts in histograms
+            )
+
+        # Ordena os valores pelo número de conflitos (ascendente); as pontuações
+        # ficam em uma lista alinhada aos valores e a ordenação estável dos
+        # índices é feita inteiramente em C
+        values = list(self.domain_values(var))
+        scores = [count_conflicts(value) for value in values]
+        for i in sorted(range(len(values)), key=scores.__getitem__):
+            yield values[i]
 
     def select_unassigned_variable(self, assignment):
         """
         Seleciona uma variável não atribuída usando as heurísticas MRV e de Grau.
         """
-        unassigned_vars = [v for v in self.crossword.variables if v not in assignment]
-        # Heurística MRV: menor número de valores no domínio
-        min_domain_size = min(len(self.domains[var]) for var in unassigned_vars)
-        mrv_vars = [var for var in unassigned_vars if len(self.domains[var]) == min_domain_size]
-        if len(mrv_vars) == 1:
-            return mrv_vars[0]
-        # Heurística de Grau: maior número de vizinhos
-        max_degree = -1
-        selected_var = None
-        for var in mrv_vars:
-            degree = len(self.crossword.neighbors(var))
-            if degree > max_degree:
-                max_degree = degree
-                selected_var = var
-        return selected_var
-
-    def backtrack(self, assignment):
+        # A fila guarda (tamanho do domínio, -grau, id, variável): o topo válido
+        # já resolve o desempate pelo maior número de vizinhos. Entradas de
+        # variáveis atribuídas ou com tamanho desatualizado são descartadas.
+        heap = self._mrv_heap
+        if len(heap) > 4 * len(self.crossword.variables):
+            self.rebuild_mrv_heap()
+        sizes = self._domain_sizes
+        while heap:
+            size, _, var_id, var = heap[0]
+            if var not in assignment and size == sizes[var_id]:
+                return var
+            heapq.heappop(heap)
+        # Variáveis não atribuídas cujas entradas foram descartadas
+        self.rebuild_mrv_heap(assignment)
+        return heap[0][3]
+
+    def rebuild_mrv_heap(self, assignment=None):
+        """
+        Reconstrói a fila de prioridade da heurística MRV a partir dos
+        tamanhos de domínio atuais, omitindo as variáveis de `assignment`.
+        """
+        self._mrv_heap[:] = [
+            (size, -len(self._neighbors[var]), var_id, var)
+            for var_id, (var, size) in enumerate(
+                zip(self._variables, self._domain_sizes)
+            )
+            if assignment is None or var not in assignment
+        ]
+        heapq.heapify(self._mrv_heap)
+
+    def undo(self, trail):
+        """
+        Desfaz as remoções registradas em `trail`, da mais recente à mais antiga,
+        restaurando o domínio anterior de cada variável.
+        """
+        for var, domain in reversed(trail):
+            self.update_domain(var, domain)
+
+    def backtrack(self, assignment, assigned_words=None):
         """
         Realiza uma busca de backtracking para encontrar uma atribuição completa e consistente.
+        `assigned_words` é o conjunto de identificadores das palavras já usadas
+        em `assignment`.
+        A busca é iterativa: cada nível da árvore é um quadro em uma pilha explícita.
         """
+        assignment = assignment.copy()
         if self.assignment_complete(assignment):
             return assignment
+        # Identificadores das palavras atribuídas, mantidos junto a `assignment`
+        assigned_ids = {
+            var: self._word_id[word] for var, word in assignment.items()
+        }
+        if assigned_words is None:
+            assigned_words = set(assigned_ids.values())
 
+        # Cada quadro guarda [variável, valores restantes, trail, valor atribuído]
         var = self.select_unassigned_variable(assignment)
-        for value in self.order_domain_values(var, assignment):
-            # Cria uma nova atribuição incluindo var=value
-            local_assignment = assignment.copy()
-            local_assignment[var] = value
-            if self.consistent(local_assignment):
-                # Inference: faz uma cópia dos domínios
-                saved_domains = copy.deepcopy(self.domains)
-                self.domains[var] = {value}
+        stack = [[var, self.order_domain_values(var, assignment), None, None]]
+        while stack:
+            frame = stack[-1]
+            var, values, trail, value = frame
+            if trail is not None:
+                # Desfaz o valor tentado anteriormente nesta variável
+                del assignment[var]
+                del assigned_ids[var]
+                assigned_words.remove(value)
+                self.undo(trail)
+                frame[2] = frame[3] = None
+
+            for value in values:
+                # Verifica unicidade das palavras
+                if value in assigned_words:
+                    continue
+                if not self.consistent_value(var, value, assigned_ids):
+                    continue
+                word = self._words[value]
+                # Inference: registra as remoções para desfazê-las depois
+                trail = [(var, self.domains[var])]
+                if self.domains[var] == 1 << value:
+                    # O domínio já era unitário e os arcos para var já estão
+                    # consistentes: não há o que propagar
+                    break
+                self.update_domain(var, 1 << value)
                 # Impõe consistência de arco após a atribuição
-                if self.ac3([(neighbor, var) for neighbor in self.crossword.neighbors(var)]):
-                    result = self.backtrack(local_assignment)
-                    if result:
-                        return result
+                arcs = [(neighbor, var) for neighbor in self._neighbors[var]]
+                if self.ac3(arcs, trail=trail):
+                    break
                 # Restaura os domínios
-                self.domains = saved_domains
+                self.undo(trail)
+            else:
+                # Nenhum valor restante: retrocede para o nível anterior
+                stack.pop()
+                continue
+
+            # Estende a atribuição com var=word e desce um nível
+            assignment[var] = word
+            assigned_ids[var] = value
+            assigned_words.add(value)
+            frame[2] = trail
+            frame[3] = value
+            if self.assignment_complete(assignment):
+                return assignment
+            var = self.select_unassigned_variable(assignment)
+            stack.append([var, self.order_domain_values(var, assignment), None, None])
         return None
 
+    def solve_branch(self, var, value):
+        """
+        Atribui value a var e resolve o restante do CSP a partir daí.
+        Retorna a atribuição completa, ou None se não houver solução; nesse
+        caso os domínios voltam ao estado anterior, prontos para outro valor.
+        """
+        trail = [(var, self.domains[var])]
+        self.update_domain(var, 1 << value)
+        result = None
+        arcs = [(neighbor, var) for neighbor in self._neighbors[var]]
+        if self.ac3(arcs, trail=trail):
+            result = self.backtrack({var: self._words[value]}, {value})
+        if result is None:
+            self.undo(trail)
+        return result
+
+    def backtrack_parallel(self, workers):
+        """
+        Divide a busca na raiz: cada valor da primeira variável é uma subárvore
+        independente, resolvida em um processo separado com `solve_branch`.
+        Retorna a primeira solução encontrada por qualquer processo, que não é
+        necessariamente a mesma de `backtrack`; os processos ainda em execução
+        são encerrados assim que há uma solução.
+        """
+        if self.assignment_complete(dict()):
+            return dict()
+        var = self.select_unassigned_variable(dict())
+        values = list(self.order_domain_values(var, dict()))
+        # O gerador é serializado uma vez por processo, no inicializador; as
+        # tarefas levam apenas o identificador da palavra. Ao sair do bloco
+        # `with`, o pool é terminado: subárvores em andamento são interrompidas
+        # em vez de exploradas até o fim
+        with multiprocessing.Pool(
+            processes=workers,
+            initializer=_init_branch_worker,
+            initargs=(self, var)
+        ) as pool:
+            for result in pool.imap_unordered(_solve_branch_worker, values):
+                if result is not None:
+                    return result
+        return None
+
+
+def _init_branch_worker(creator, var):
+    """
+    Guarda no processo o gerador e a variável da raiz de `backtrack_parallel`.
+    """
+    global _branch_creator, _branch_var
+    _branch_creator = creator
+    _branch_var = var
+
+
+def _solve_branch_worker(value):
+    """
+    Resolve, no processo atual, a subárvore em que a variável da raiz vale value.
+    """
+    return _branch_creator.solve_branch(_branch_var, value)
+
 
 def main():
     if len(sys.argv) not in [3, 4]: